@@ -1,8 +1,24 @@
 #!/usr/bin/python
 _VERBOSE = True
 
+import asyncio
+import concurrent.futures
+import io
+import itertools
 import os
-import xml.etree.ElementTree as ET
+import subprocess
+import threading
+
+try:
+    from lxml import etree as ET
+
+    # <elementParameter> children of a component that carry a value
+    _element_parameters = ET.XPath("./*[local-name()='elementParameter'][@value]")
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+    def _element_parameters(node):
+        return node.findall("{*}elementParameter[@value]")
 
 
 class TalendProject(object):
@@ -13,30 +29,54 @@ class TalendProject(object):
         self.git_tags = None
         self.author = None
         self.jobs = {}
-        # job name -> job version list (JOB_NAME: {LATEST: version#, v1: path, ...})
-        self.versions = {}
+        # (job name, version) -> item path, e.g. ('JOB_NAME', (0, 1)): 'process/JOB_NAME_0.1.item'
+        self.paths = {}
+        # job name -> latest version, e.g. 'JOB_NAME': (0, 1)
+        self.latest = {}
         self.talend_version = None
         self.project_name = None
+        self._batch = None
+        # item path -> prefetched blob, consumed by GitFile on first read
+        self._blob_cache = {}
+        # job name -> latest TalendJob, filled in by __getitem__
+        self._job_cache = {}
+        # computed once by get_master_jobs; the job set is fixed after _load
+        self._masters = None
+        # job name -> result, for tree_view and get_merged_context
+        self._tree_cache = {}
+        self._context_cache = {}
         self._load()
 
+    def __del__(self):
+        if getattr(self, '_batch', None) is not None:
+            self._batch.close()
+
     def __repr__(self):
         return "Talend project with {0} jobs located in {1}".format(
-            len(self.versions), self.path)
+            len(self.latest), self.path)
 
     def _load(self):
-        # get all .item's
-        items = self._get_item_paths()
+        git_dir = self.path if self.is_bare_repo else os.path.join(self.path, ".git")
 
-        # get tags (NOTE: this won't include the CURRENT deployment tag if this is a deployment request!)
-        self.git_tags = self._get_tags()
+        # one long-lived git process serves every blob read for this project
+        if self.ref is not None:
+            self._batch = GitCatFile(git_dir)
 
-        self.author = self._get_author()
+        # get .item list, tags, author and talend.project all at once
+        # (NOTE: tags won't include the CURRENT deployment tag if this is a deployment request!)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            metadata = asyncio.run(self._load_metadata())
+        else:
+            # already inside an event loop (async service, Jupyter), where
+            # asyncio.run() is not allowed; give the queries a loop of their own
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
+                metadata = ex.submit(asyncio.run, self._load_metadata()).result()
+        items, self.git_tags, self.author, project = metadata
 
         # get Talend version
-        stream = GitFile(self.path, "talend.project", self.ref, self.is_bare_repo).get_stream()
-        root = ET.parse(stream).getroot()
-        if stream.close() is not None:
-            raise IOError("Problem reading talend.project file")
+        root = ET.fromstring(project)
 
         if 'productVersion' in root[0].attrib:
             self.talend_version = root[0].attrib['productVersion']
@@ -50,96 +90,152 @@ class TalendProject(object):
 
 
         for i in items:
-            name = i.split('/')[-1][:-9]
-            version = float(i.split('_')[-1][:-5])
-
-            if name in self.versions:
-                if 'LATEST' in self.versions[name]:
-                    # check if this version is greater
-                    if version > self.versions[name]['LATEST']:
-                        self.versions[name]['LATEST'] = version
-                self.versions[name][version] = i
-            else:
-                self.versions[name] = {version: i, 'LATEST': version}
+            # process/.../JOB_NAME_0.1.item
+            name, version = i.split('/')[-1][:-5].rsplit('_', 1)
+            # compare versions numerically so that 0.10 > 0.9; the job itself
+            # keeps the float version it has always reported
+            key = tuple(int(x) for x in version.split('.'))
 
+            self.paths[(name, key)] = i
 
-            self.jobs[i] = TalendJob(name, i, GitFile(self.path, i, self.ref, self.is_bare_repo), version=version, parse=False)
+            self.jobs[i] = TalendJob(name, i, GitFile(self.path, i, self.ref, self.is_bare_repo, self._batch, self._blob_cache), version=float(version), parse=False)
             #verbose("Initialized job " + name)
 
+        for name, key in self.paths:
+            if name not in self.latest or key > self.latest[name]:
+                self.latest[name] = key
+
+    async def _load_metadata(self):
+        # the git calls are independent, so run them side by side. Let every
+        # call finish before raising so no child process outlives the loop.
+        results = await asyncio.gather(self._get_item_paths(),
+                                       self._get_tags(),
+                                       self._get_author(),
+                                       self._get_project_file(),
+                                       return_exceptions=True)
+        for r in results:
+            if isinstance(r, Exception):
+                raise r
+        return results
+
     def __getitem__(self, job_name):
         # gets the latest version of job
         if 'item' in job_name:
             return self.jobs[job_name]
-        else:
-            return self.jobs[self.versions[job_name][self.versions[job_name]['LATEST']]]
+
+        job = self._job_cache.get(job_name)
+        if job is None:
+            job = self.jobs[self.paths[(job_name, self.latest[job_name])]]
+            self._job_cache[job_name] = job
+        return job
 
     def __iter__(self):
-        for item in self.versions:
+        for item in self.latest:
             yield self[item]
 
     def list_jobs(self):
-        for j in self.versions:
+        versions = {}
+        for (name, _), path in sorted(self.paths.items()):
+            versions.setdefault(name, []).append(self.jobs[path].version)
+
+        for j in self.latest:
             print(j)
-            print("\t" + str([v for v in self.versions[j] if not v == 'LATEST']))
-            print("\tLATEST: " + str(self.versions[j]['LATEST']))
+            print("\t" + str(versions[j]))
+            print("\tLATEST: " + str(self[j].version))
+
+    def _prefetch_blobs(self, paths):
+        # pull every blob through the batch pipe in one go instead of one
+        # round trip per job
+        if self._batch is None:
+            return
+
+        paths = [p for p in paths if p not in self._blob_cache]
+        objects = ["{0}:{1}".format(self.ref, p) for p in paths]
+        for (_, blob), path in zip(self._batch.read_many(objects), paths):
+            # a missing blob is left for the job's own read to report
+            if blob is not None:
+                self._blob_cache[path] = blob
+
+    def parse_all(self, parallel=True):
+        # parse the latest version of every job. lxml releases the GIL while
+        # parsing, so the jobs can be spread over a thread pool.
+        jobs = [j for j in self if not j.parsed]
+        self._prefetch_blobs(j.path for j in jobs)
+
+        if not parallel:
+            for j in jobs:
+                j.parse()
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            list(ex.map(lambda j: j.parse(), jobs))
 
     def get_all_tables(self):
         tables = set()
+        self.parse_all()
         for j in self:
             j.parse()
             tables |= j.tables
         return list(tables)
 
-    def _get_item_paths(self):
-        ret = []
+    async def _git(self, *args):
         git_dir = self.path if self.is_bare_repo else os.path.join(self.path, ".git")
 
+        proc = await asyncio.create_subprocess_exec("git", "--git-dir", git_dir, *args,
+                                                    stdout=subprocess.PIPE)
+        out, _ = await proc.communicate()
+        return proc.returncode, out
+
+    async def _get_item_paths(self):
+        ret = []
+
         # get list from git
-        git_stream = os.popen("git --git-dir \"{0}\" ls-tree --full-tree -r {1}".format(git_dir, self.ref))
-        lines = git_stream.readlines()
+        returncode, out = await self._git("ls-tree", "--full-tree", "-r", self.ref)
 
-        if git_stream.close() is not None:
+        if returncode != 0:
             raise IOError("Error reading item list!")
 
-        ret = [x.split()[3] for x in lines if "process" in x and ".item" in x]
+        # filter on the raw bytes so non-matching lines are never decoded
+        ret = [x.split(None, 3)[3].decode() for x in out.splitlines() if b"process" in x and b".item" in x]
 
         return ret
 
-    def _get_tags(self):
-        git_dir = self.path if self.is_bare_repo else os.path.join(self.path, ".git")
-
+    async def _get_tags(self):
         # get list from git
-        git_stream = os.popen("git --git-dir \"{0}\" tag --points-at {1}".format(git_dir, self.ref))
-
         try:
-            lines = git_stream.readlines()
-        except IOError:
+            returncode, out = await self._git("tag", "--points-at", self.ref)
+        except OSError:
             return []
 
-        if git_stream.close() is not None:
+        if returncode != 0:
             return []
 
-        return [l.strip() for l in lines]
-
-    def _get_author(self):
-        git_dir = self.path if self.is_bare_repo else os.path.join(self.path, ".git")
+        return [l.strip() for l in out.decode().splitlines()]
 
+    async def _get_author(self):
         # get list from git
-        git_stream = os.popen("git --git-dir \"{0}\" show -s --format=\"%aN <%aE>\" {1}".format(git_dir, self.ref))
-
         try:
-            lines = git_stream.readlines()
-        except IOError:
+            returncode, out = await self._git("show", "-s", "--format=%aN <%aE>", self.ref)
+        except OSError:
             return "Error reading author"
 
-        if git_stream.close() is not None:
+        if returncode != 0:
             return "Error reading author"
 
-        if lines is None or len(lines) == 0:
+        lines = out.decode().splitlines()
+        if len(lines) == 0:
             return "Error reading author"
 
         return lines[0].strip()
 
+    async def _get_project_file(self):
+        returncode, out = await self._git("cat-file", "blob", "{0}:talend.project".format(self.ref))
+
+        if returncode != 0:
+            raise IOError("Problem reading talend.project file")
+
+        return out
+
 
     def review(self, job, children=True):
         # format:
@@ -147,9 +243,10 @@ class TalendProject(object):
         ret = {}
 
         if job:
-            ret = self[job].review()
+            j = self[job]
+            ret = j.review()
             if children:
-                for child in self[job].children:
+                for child in j.children:
                     child_errs = self.review(child)
                     for err in child_errs:
                         if not err in ret:
@@ -159,6 +256,7 @@ class TalendProject(object):
 
         else:
             # check all jobs
+            self.parse_all()
             for j in self:
                 ret[j.name] = j.review()
         return ret
@@ -172,6 +270,7 @@ class TalendProject(object):
                 ret.append(self.dump_sql(child, header=header))
         else:
             # dump all sql
+            self.parse_all()
             for j in self:
                 ret.append(j.dump_sql(header=header))
 
@@ -185,30 +284,45 @@ class TalendProject(object):
 
 
     def review_with_info(self, job, children=True):
+        if not job:
+            self.parse_all()
+
         dbinfo = self.get_database_info(job, children)
         dbinfo = [{'host': x[0], 'database': x[1], 'user': x[2]} for x in set(dbinfo)]
+        j = self[job]
         return {
                 'project_name':     self.project_name,
                 'author':           self.author,
                 'git_tags':         self.git_tags,
                 'talend_version':   self.talend_version,
-                'job_name':         self[job].name,
+                'job_name':         j.name,
                 'repo_path':        self.path,
                 'commit_ref':       self.ref,
                 'errors':           self.review(job, children),
                 'dbinfo':           dbinfo,
                 'context':          self.get_merged_context(job),
-                'tree':             self.tree_view(self[job].name),
-                'job_version':      self[job].version
+                'tree':             self.tree_view(j.name),
+                'job_version':      j.version
                }
 
     def get_merged_context(self, job):
+        # hand out a copy so callers can't alter the cached result
+        return {context: dict(params) for context, params in self._merged_context(job).items()}
+
+    def _merged_context(self, job):
+        if job in self._context_cache:
+            return self._context_cache[job]
+
         ctx = {}
-        for context in self[job].context:
-            ctx[context] = self[job].context[context]
+        j = self[job]
+        if not j.parsed:
+            j.parse()
+        # copy, so merging never writes into a job's own (or a cached) context
+        for context in j.context:
+            ctx[context] = dict(j.context[context])
 
-        for child in self[job].children:
-            child_contexts = self.get_merged_context(child)
+        for child in j.children:
+            child_contexts = self._merged_context(child)
 
             for context in child_contexts:
                 if context in ctx:
@@ -216,21 +330,27 @@ class TalendProject(object):
                         if param not in ctx[context]:
                             ctx[context][param] = child_contexts[context][param]
                 else:
-                    ctx[context] = child_contexts[context]
+                    ctx[context] = dict(child_contexts[context])
+
+        self._context_cache[job] = ctx
         return ctx
 
 
-    def get_database_info(self, job, children=True):
+    def get_database_info(self, job, children=True, _visited=None):
         ret = []
         if job:
-            ret += self[job].get_database_info()
+            # jobs already collected on this walk; guards against tRunJob cycles
+            if _visited is None:
+                _visited = set()
+            if job in _visited:
+                return ret
+            _visited.add(job)
+
+            j = self[job]
+            ret += j.get_database_info()
             if children:
-                for child in self[job].children:
-                    if child in ret:
-                        # possible infinite loop.
-                        continue
-                    else:
-                        ret += self.get_database_info(child)
+                for child in j.children:
+                    ret += self.get_database_info(child, _visited=_visited)
         else:
             # check all jobs
             for j in self:
@@ -240,28 +360,43 @@ class TalendProject(object):
 
 
     def get_master_jobs(self):
-        masters = {j: True for j in self.versions}
-        for j in self.versions:
-            if not self[j].parsed:
-                self[j].parse()
+        if self._masters is not None:
+            return list(self._masters)
+
+        masters = {j: True for j in self.latest}
+        for name in self.latest:
+            j = self[name]
+            j.parse_children_only()
 
-            for child in self[j].children:
+            for child in j.children:
                 masters[child] = False
 
-        return [j for j in masters if masters[j]]
+        self._masters = [j for j in masters if masters[j]]
+        return list(self._masters)
 
     def tree_view(self, root=None):
-        if not root in self.versions:
+        # cached trees share subtrees, so hand out an unshared copy
+        return _copy_tree(self._tree(root))
+
+    def _tree(self, root):
+        if root in self._tree_cache:
+            return self._tree_cache[root]
+
+        if not root in self.latest:
             return {}
         if root:
             tree = {root: {}}
-            for child in self[root].children:
-                tree[root][child] = self.tree_view(child)[child]
+            j = self[root]
+            j.parse_children_only()
+            for child in j.children:
+                tree[root][child] = self._tree(child)[child]
         else:
             tree = {}
             masters = self.get_master_jobs()
             for master in masters:
-                tree.update(self.tree_view(master))
+                tree.update(self._tree(master))
+
+        self._tree_cache[root] = tree
         return tree
 
 
@@ -276,9 +411,12 @@ class TalendJob(object):
         self.connections = {}
         self.context = {}
         self.children = []
+        self.children_parsed = False
         self.gitfile = gitfile
         self.use_teradata = None
         self.use_files = False
+        # (name, params) of active teradata components, for the EDW review checks
+        self._teradata_nodes = []
         self.parsed = False
         self.tables = set()
         if parse: self.parse() 
@@ -307,31 +445,34 @@ class TalendJob(object):
             return
 
         stream = self.gitfile.get_stream()
-        root = ET.parse(stream).getroot()
-        if stream.close() is not None:
-            raise IOError("Problem reading file " + self.gitfile)
 
         self.use_teradata = False
         self.use_files = False
+        self._teradata_nodes = []
+        # may have been filled in by parse_children_only()
+        self.children = []
 
         # get all components, connections, and context parameters
-        for node in root:
+        for node in _iter_top_level(stream):
             if 'node' in node.tag:
                 params = {}
 
-                for element in node:
-                    if 'elementParameter' in element.tag and 'value' in element.attrib:
-                        params[element.attrib['name']] = element.attrib['value']
+                for element in _element_parameters(node):
+                    params[element.get('name')] = element.get('value')
 
                 if 'ACTIVATE' in params and params['ACTIVATE'] == 'false':
                     continue
 
                 params['_componentName'] = node.attrib['componentName']
 
-                if not self.use_teradata and 'teradata' in params['_componentName'].lower():
+                # classify the component once here, so review() doesn't re-lowercase the name per pass
+                component = params['_componentName'].lower()
+
+                if 'teradata' in component:
                     self.use_teradata = True
+                    self._teradata_nodes.append((params['UNIQUE_NAME'], params))
 
-                if not self.use_files and 'file' in params['_componentName'].lower():
+                if 'file' in component:
                     self.use_files = True
 
                 self.nodes[params['UNIQUE_NAME']] = params
@@ -364,10 +505,37 @@ class TalendJob(object):
                     params[context_param.attrib['name']] = context_param.attrib['value']
                 self.context[context_name] = params
 
+        stream.close()
+
+        self.parsed = True
+        self.children_parsed = True
+
+    def parse_children_only(self):
+        # Lightweight parse that only collects the tRunJob children, for
+        # walking the job tree without building every component.
+        if self.children_parsed:
+            return
+
+        stream = self.gitfile.get_stream()
 
+        children = []
+        for node in _iter_top_level(stream):
+            if 'node' not in node.tag or node.get('componentName') != 'tRunJob':
+                continue
 
+            params = {}
+            for element in _element_parameters(node):
+                params[element.get('name')] = element.get('value')
 
-        self.parsed = True
+            if 'ACTIVATE' in params and params['ACTIVATE'] == 'false':
+                continue
+
+            children.append(params['PROCESS'])
+
+        stream.close()
+
+        self.children = children
+        self.children_parsed = True
 
     # static review parameters:
     check_params = {'DIE_ON_ERROR':              'true',
@@ -389,6 +557,11 @@ class TalendJob(object):
 
     edw_context  = ['EDW_HOST', 'EDW_USER', 'EDW_PASS']
 
+    # frozen (param, expected) pairs for the per-node review loop
+    check_items  = tuple(check_params.items())
+    file_items   = tuple(file_params.items())
+    edw_items    = tuple((k, tuple(v)) for k, v in edw_params.items())
+
     def review(self):
         # Review will report on:
         #   DIE_ON_ERROR = true
@@ -398,59 +571,67 @@ class TalendJob(object):
             self.parse()
 
         # review results are stored as {error name: {job name: [{component: component, message: mesg}, ...]}}
-        results = {k: {self.name: []} for k in TalendJob.check_params}
-        results.update({k: {self.name: []} for k in TalendJob.edw_params})
-        results.update({k: {self.name: []} for k in TalendJob.file_params})
-        results['ON_COMPONENT_ERROR'] = {self.name: []}
-        results['CONTEXT'] = {self.name: []}
-        results['QUERY'] = {self.name: []}
+        results = {k: {self.name: []} for k in itertools.chain(TalendJob.check_params,
+                                                               TalendJob.edw_params,
+                                                               TalendJob.file_params,
+                                                               ('ON_COMPONENT_ERROR', 'CONTEXT', 'QUERY'))}
 
-        for node in self.nodes:
-            if 'ACTIVATE' in self.nodes[node] and self.nodes[node]['ACTIVATE'] == 'false':
+        for node, n in self.nodes.items():
+            if n.get('ACTIVATE') == 'false':
                 # node disabled, skip
                 continue
 
-#           if 'QUERY' in self.nodes[node] and "--" in self.nodes[node]['QUERY']:
+#           if 'QUERY' in n and "--" in n['QUERY']:
 #               results['QUERY'][self.name].append({
 #                       'component': node,
 #                       'message': "Please use multiline comments '/* ... */' instead of single line '--'",
 #                       })
 
-            for param in TalendJob.check_params:
-                if param in self.nodes[node] and self.nodes[node][param] != TalendJob.check_params[param]:
+            for param, expected in TalendJob.check_items:
+                value = n.get(param)
+                if value is not None and value != expected:
                     results[param][self.name].append({
                               'component': node,
                               'message': "Value '{0}' must be set to '{1}' (actual: '{2}')".format(
                                         param,
-                                        TalendJob.check_params[param],
-                                        self.nodes[node][param])})
+                                        expected,
+                                        value)})
 
-            # check EDW context variables
-            if self.use_teradata and 'teradata' in self.nodes[node]['_componentName'].lower() and (not 'USE_EXISTING_CONNECTION' in self.nodes[node] or self.nodes[node]['USE_EXISTING_CONNECTION'] == 'false'):
-                for param in TalendJob.edw_params:
-                    if param in self.nodes[node] and not self.nodes[node][param] in TalendJob.edw_params[param]:
-                        msg = self.nodes[node][param]
-                        if 'Encrypt' in msg:
-                            msg = '*ENCRYPTED*'
+        # check EDW context variables
+        for node, n in self._teradata_nodes:
+            if n.get('USE_EXISTING_CONNECTION', 'false') != 'false':
+                continue
 
-                        results[param][self.name].append({
-                                  'component': node,
-                                  'type': self.nodes[node]['TYPE'],
-                                  'message': "Value '{0}' must be set to '{1}' (actual: '{2}')".format(
-                                            param,
-                                            TalendJob.edw_params[param][0],
-                                            msg)})
-
-            # Check file parameters
-            if self.use_files:
-                for param in TalendJob.file_params:
-                    if param in self.nodes[node] and self.nodes[node][param] != TalendJob.file_params[param]:
+            for param, expected in TalendJob.edw_items:
+                value = n.get(param)
+                if value is not None and value not in expected:
+                    msg = value
+                    if 'Encrypt' in msg:
+                        msg = '*ENCRYPTED*'
+
+                    results[param][self.name].append({
+                              'component': node,
+                              'type': n['TYPE'],
+                              'message': "Value '{0}' must be set to '{1}' (actual: '{2}')".format(
+                                        param,
+                                        expected[0],
+                                        msg)})
+
+        # Check file parameters
+        if self.use_files:
+            for node, n in self.nodes.items():
+                if n.get('ACTIVATE') == 'false':
+                    continue
+
+                for param, expected in TalendJob.file_items:
+                    value = n.get(param)
+                    if value is not None and value != expected:
                         results[param][self.name].append({
                               'component': node,
                               'message': "Value '{0}' must be set to '{1}' (actual: '{2}')".format(
                                         param,
-                                        TalendJob.file_params[param],
-                                        self.nodes[node][param])})
+                                        expected,
+                                        value)})
 
         # check context
         if self.use_teradata:
@@ -473,20 +654,24 @@ class TalendJob(object):
                     'message': "'OnComponentError' trigger depreciated. Use 'if' trigger instead."})
 
         # Will return {} if no errors
-        return {e: results[e] for e in results if results[e][self.name]}
+        return {e: v for e, v in results.items() if v[self.name]}
 
     def get_database_info(self):
         if not self.parsed:
             self.parse()
 
         info = [] # [host, dbname]
-        for node in self:
-            if "USE_EXISTING_CONNECTION" in node and node['USE_EXISTING_CONNECTION'] == 'true':
+        for n in self.nodes.values():
+            if n.get('USE_EXISTING_CONNECTION') == 'true':
                 continue
 
-            host = node['HOST'].upper() if 'HOST' in node else None
-            dbname = node['DBNAME'].strip('"').upper() if 'DBNAME' in node else None
-            user = node['USER'] if 'USER' in node else None
+            host = n.get('HOST')
+            if host is not None:
+                host = host.upper()
+            dbname = n.get('DBNAME')
+            if dbname is not None:
+                dbname = dbname.strip('"').upper()
+            user = n.get('USER')
 
             if host and dbname:
                 info.append((host, dbname, user))
@@ -498,24 +683,23 @@ class TalendJob(object):
             self.parse()
 
         ret = []
-        for node in self.nodes:
-            if ('ACTIVATE' in self.nodes[node] and
-                    self.nodes[node]['ACTIVATE'] == 'false'):
+        for node, n in self.nodes.items():
+            if n.get('ACTIVATE') == 'false':
                 continue
 
-            if 'QUERY' in self.nodes[node]:
-                if 'DBNAME' in self.nodes[node]:
-                    schema = self.nodes[node]['DBNAME']
-                else:
-                    schema = '???'
+            query = n.get('QUERY')
+            if query is None:
+                continue
+
+            schema = n.get('DBNAME', '???')
 
-                # header
-                if header:
-                    ret.append("-- Job Name:\t{0}\n-- Component:\t{1}\n-- Schema:\t{2}".format(self.name,
-                                                                                                node, schema))
+            # header
+            if header:
+                ret.append("-- Job Name:\t{0}\n-- Component:\t{1}\n-- Schema:\t{2}".format(self.name,
+                                                                                            node, schema))
 
-                # text
-                ret.append(self.nodes[node]['QUERY'].replace('"', ''))
+            # text
+            ret.append(query.replace('"', ''))
 
         return "\n".join(ret)
 
@@ -524,43 +708,189 @@ class TalendJob(object):
             self.parse()
 
         ret = {}
-        for node in self.nodes:
-            if ('ACTIVATE' in self.nodes[node] and
-                    self.nodes[node]['ACTIVATE'] == 'false'):
+        for node, n in self.nodes.items():
+            if n.get('ACTIVATE') == 'false':
                 continue
 
-            if 'QUERY' in self.nodes[node]:
-                if 'DBNAME' in self.nodes[node]:
-                    schema = self.nodes[node]['DBNAME']
-                else:
-                    schema = '???'
+            query = n.get('QUERY')
+            if query is None:
+                continue
 
-                # text
-                ret[node] = (schema, self.nodes[node]['QUERY'].replace('"', ''))
+            schema = n.get('DBNAME', '???')
+
+            # text
+            ret[node] = (schema, query.replace('"', ''))
 
         return ret
 
 
+class GitCatFile(object):
+    # Wraps a single `git cat-file --batch` process. Each request is a line
+    # "<ref>:<path>" on stdin, answered on stdout by "<sha> blob <size>"
+    # followed by the content and a trailing newline, or by "<obj> missing".
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self.proc = None
+        # requests and answers must stay paired when jobs parse on several threads
+        self.lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self.proc = subprocess.Popen(["git", "--git-dir", self.git_dir, "cat-file", "--batch"],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def _stop(self):
+        # kill rather than wait for a clean exit: git may be blocked writing
+        # answers that will never be read
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    def _restart(self):
+        # after a failed read the pipe holds unread answers, so any further
+        # request would get the wrong blob back
+        self._stop()
+        self._start()
+
+    def _submit(self, objects):
+        self.proc.stdin.writelines(o.encode() + b"\n" for o in objects)
+        self.proc.stdin.flush()
+
+    def _submit_quietly(self, objects):
+        # writer thread for read_many; the process may be killed under it
+        try:
+            self._submit(objects)
+        except (OSError, ValueError):
+            pass
+
+    def _reap(self, obj):
+        # returns None for a missing object; raises IOError if the answer
+        # can't be understood
+        header = self.proc.stdout.readline()
+        if not header:
+            raise IOError("git cat-file exited while reading " + obj)
+
+        fields = header.rsplit(None, 2)
+        if len(fields) == 2 and fields[1] == b"missing":
+            return None
+        if len(fields) != 3 or fields[1] != b"blob":
+            raise IOError("Problem reading file " + obj)
+
+        try:
+            size = int(fields[2])
+        except ValueError:
+            raise IOError("Problem reading file " + obj)
+
+        payload = self.proc.stdout.read(size)
+        # trailing newline after the content
+        if len(payload) != size or self.proc.stdout.read(1) != b"\n":
+            raise IOError("git cat-file exited while reading " + obj)
+        return payload
+
+    def read(self, obj):
+        with self.lock:
+            try:
+                self._submit([obj])
+                payload = self._reap(obj)
+            except BaseException:
+                self._restart()
+                raise
+
+        if payload is None:
+            raise IOError("Problem reading file " + obj)
+        return payload
+
+    def read_many(self, objects):
+        # Submit every request up front and reap the answers in order,
+        # yielding None for missing objects. The requests are written from a
+        # separate thread so neither side of the pipe can fill up and stall
+        # the other. If reading stops early the process is restarted, since
+        # the remaining answers are still queued on its stdout.
+        objects = list(objects)
+        with self.lock:
+            writer = threading.Thread(target=self._submit_quietly, args=(objects,))
+            writer.start()
+            try:
+                for obj in objects:
+                    yield obj, self._reap(obj)
+            except BaseException:
+                self._stop()
+                writer.join()
+                self._start()
+                raise
+            writer.join()
+
+    def close(self):
+        with self.lock:
+            self._stop()
+
+
 class GitFile(object):
-    def __init__(self, parent, child, ref="MASTER", bare=True):
+    def __init__(self, parent, child, ref="MASTER", bare=True, batch=None, cache=None):
         self.child = child
         self.ref = ref
+        self.batch = batch
+        self.cache = cache
         if bare == False:
             self.parent = os.path.join(parent, ".git")
         else:
             self.parent = parent
 
+    def read_bytes(self):
+        # raw blob content; the XML parser handles the decoding itself
+        if self.ref is None:
+            with open(os.path.join(self.parent, self.child), 'rb') as f:
+                return f.read()
+
+        if self.cache and self.child in self.cache:
+            return self.cache.pop(self.child)
+
+        obj = "{0}:{1}".format(self.ref, self.child)
+        if self.batch is not None:
+            return self.batch.read(obj)
+
+        proc = subprocess.run(["git", "--git-dir", self.parent, "show", obj], stdout=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise IOError("Problem reading file " + obj)
+        return proc.stdout
+
     def get_stream(self):
         if self.ref is None:
-            return open(os.path.join(self.parent, self.child), 'r')
-        else:
-            return os.popen("git --git-dir \"{0}\" show {1}:{2}".format(
-                self.parent, self.ref, self.child))
+            return open(os.path.join(self.parent, self.child), 'rb')
+        return io.BytesIO(self.read_bytes())
 
     def __repr__(self):
         return "{0}/{2} [{1}]".format(self.parent, self.ref, self.child)
 
 
+def _copy_tree(tree):
+    return {k: _copy_tree(v) for k, v in tree.items()}
+
+
+def _iter_top_level(stream):
+    # Walk the document incrementally and yield each top-level element once
+    # it is complete. Yielded elements are detached from the root, so only
+    # one of them is held in memory at a time.
+    root = None
+    depth = 0
+    for event, node in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = node
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 1:
+            root.remove(node)
+            yield node
+
+
 def verbose(mesg):
     if _VERBOSE == True:
         print(mesg)
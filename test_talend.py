@@ -0,0 +1,65 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import talend
+
+PROJECT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<xmi:XMI xmlns:xmi="http://www.omg.org/XMI" xmlns:TalendProperties="http://www.talend.org/properties">
+  <TalendProperties:Project productVersion="7.3.1" technicalLabel="DEMO"/>
+</xmi:XMI>
+"""
+
+JOB = """<?xml version="1.0" encoding="UTF-8"?>
+<talendfile:ProcessType xmlns:talendfile="platform:/resource/org.talend.model/model/TalendFile.xsd">
+  <node componentName="tJava">
+    <elementParameter name="UNIQUE_NAME" value="{0}_java"/>
+  </node>
+</talendfile:ProcessType>
+"""
+
+
+class PrefetchTest(unittest.TestCase):
+    JOBS = ['Alpha', 'Bravo', 'Charlie']
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.repo, 'process'))
+        with open(os.path.join(self.repo, 'talend.project'), 'wb') as f:
+            f.write(PROJECT)
+        for name in self.JOBS:
+            with open(os.path.join(self.repo, 'process', name + '_0.1.item'), 'w') as f:
+                f.write(JOB.format(name))
+
+        git = ['git', '-C', self.repo, '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+        subprocess.run(git + ['init', '-q'], check=True)
+        subprocess.run(git + ['add', '-A'], check=True)
+        subprocess.run(git + ['commit', '-q', '-m', 'init'], check=True)
+
+        self.project = talend.TalendProject(self.repo, is_bare_repo=False)
+
+    def tearDown(self):
+        self.project._batch.close()
+        shutil.rmtree(self.repo)
+
+    def test_missing_path_mid_batch(self):
+        paths = ['process/Alpha_0.1.item', 'process/Missing_0.1.item',
+                 'process/Bravo_0.1.item', 'process/Charlie_0.1.item']
+        self.project._prefetch_blobs(paths)
+        self.assertNotIn('process/Missing_0.1.item', self.project._blob_cache)
+
+        # every job, cached or not, still gets its own blob back
+        for name in self.JOBS:
+            job = self.project[name]
+            job.parse()
+            self.assertEqual(list(job.nodes), [name + '_java'])
+        self.assertIn(b'Alpha_java', self.project._batch.read('HEAD:process/Alpha_0.1.item'))
+
+        with self.assertRaises(IOError):
+            self.project._batch.read('HEAD:process/Missing_0.1.item')
+
+
+if __name__ == '__main__':
+    unittest.main()